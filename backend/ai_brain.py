@@ -5,19 +5,25 @@ Smart decision making for water management
 """
 
 import json
-import sqlite3
 from datetime import datetime, timedelta
-import random
 import math
+from database import DB_PATH, connect
+from weather_context import WeatherContextCache, SimulatedWeatherProvider, get_season, simulate_weather
 
 class BengaluruAIBrain:
-    def __init__(self, db_path='bengaluru_heart.db'):
+    def __init__(self, db_path=DB_PATH, weather_provider=None):
         self.db_path = db_path
         self.decision_history = []
+        # Refreshed in the background on first use, so decisions never wait on weather I/O
+        self.weather_cache = WeatherContextCache(weather_provider or SimulatedWeatherProvider())
+        
+    def close(self):
+        """Stop the background weather refresher"""
+        self.weather_cache.stop()
         
     def get_current_sensor_data(self):
         """Get current sensor data from database"""
-        conn = sqlite3.connect(self.db_path)
+        conn = connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -37,34 +43,20 @@ class BengaluruAIBrain:
         conn.close()
         return sensor_data
     
-    def get_weather_context(self):
-        """Get weather context (simulated)"""
-        # In a real implementation, this would connect to weather APIs
-        current_hour = datetime.now().hour
-        season = self._get_season()
-        
-        # Simulate weather patterns
-        if 6 <= current_hour <= 18:  # Daytime
-            rain_probability = 0.3 if season == 'monsoon' else 0.1
-        else:  # Nighttime
-            rain_probability = 0.2 if season == 'monsoon' else 0.05
-            
-        return {
-            'rain_probability': rain_probability,
-            'season': season,
-            'temperature': random.uniform(20, 35),
-            'humidity': random.uniform(40, 90)
-        }
+    def get_weather_context(self, now=None, rng=None):
+        """Get weather context
+
+        Live calls read the provider cache and never block. ``now`` and
+        ``rng`` evaluate the simulated context at a virtual time with a
+        deterministic random source, as the replay engine does.
+        """
+        if now is None and rng is None:
+            return self.weather_cache.get()
+        return simulate_weather(now, rng)
     
-    def _get_season(self):
+    def _get_season(self, now=None):
         """Determine current season"""
-        month = datetime.now().month
-        if month in [6, 7, 8, 9]:  # Monsoon
-            return 'monsoon'
-        elif month in [10, 11, 12, 1]:  # Winter
-            return 'winter'
-        else:  # Summer
-            return 'summer'
+        return get_season(now)
     
     def analyze_water_system_health(self, sensor_data):
         """Analyze overall water system health"""
@@ -246,11 +238,8 @@ class BengaluruAIBrain:
         
         return routing_plan
     
-    def make_decision(self):
-        """Main decision-making function"""
-        sensor_data = self.get_current_sensor_data()
-        weather_context = self.get_weather_context()
-        
+    def evaluate(self, sensor_data, weather_context, timestamp=None):
+        """Run the full analysis for the given conditions without storing it"""
         # Analyze system health
         health_analysis = self.analyze_water_system_health(sensor_data)
         
@@ -263,11 +252,8 @@ class BengaluruAIBrain:
         # Optimize routing
         routing_plan = self.optimize_water_routing(sensor_data)
         
-        # Store decision in database
-        self._store_decision(decisions, health_analysis)
-        
         return {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': (timestamp or datetime.now()).isoformat(),
             'health_analysis': health_analysis,
             'decisions': decisions,
             'predictions': predictions,
@@ -275,9 +261,21 @@ class BengaluruAIBrain:
             'weather_context': weather_context
         }
     
+    def make_decision(self):
+        """Main decision-making function"""
+        sensor_data = self.get_current_sensor_data()
+        weather_context = self.get_weather_context()
+        
+        result = self.evaluate(sensor_data, weather_context)
+        
+        # Store decision in database
+        self._store_decision(result['decisions'], result['health_analysis'])
+        
+        return result
+    
     def _store_decision(self, decisions, health_analysis):
         """Store AI decision in database"""
-        conn = sqlite3.connect(self.db_path)
+        conn = connect(self.db_path)
         cursor = conn.cursor()
         
         for decision in decisions:
@@ -299,7 +297,7 @@ class BengaluruAIBrain:
     
     def get_decision_history(self, hours=24):
         """Get AI decision history"""
-        conn = sqlite3.connect(self.db_path)
+        conn = connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Project Vrishabhavathi - Data Export
+Streams historical sensor data as CSV, NDJSON or Arrow IPC chunks
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # Arrow export is optional
+    pyarrow = None
+
+from database import connect
+
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_COLUMNS = ['sensor_id', 'sensor_type', 'value', 'timestamp']
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+# Same expression as the replay engine's index, so mixed timestamp
+# formats compare correctly and range filters can use the index.
+EPOCH_SQL = "CAST(strftime('%s', h.timestamp) AS INTEGER)"
+
+
+def _to_epoch(value):
+    """Convert an ISO timestamp string to epoch seconds (UTC)"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def iter_rows(db_path, sensor_ids=None, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield lists of (sensor_id, sensor_type, value, timestamp) rows in time order
+
+    ``start`` and ``end`` are epoch seconds. Rows are read in keyset pages
+    of ``chunk_rows``: each page is a short statement that finishes before
+    it is yielded, so memory stays constant and no read lock is held while
+    a slow client downloads (which would block ingest writes).
+    """
+    conditions = []
+    params = []
+    if sensor_ids:
+        conditions.append('h.sensor_id IN ({})'.format(', '.join('?' * len(sensor_ids))))
+        params.extend(sensor_ids)
+    if start is not None:
+        conditions.append(f'{EPOCH_SQL} >= ?')
+        params.append(start)
+    if end is not None:
+        conditions.append(f'{EPOCH_SQL} < ?')
+        params.append(end)
+    # Resume after the last (epoch, id) already sent; written so the epoch
+    # index can still seek to the start of the page.
+    conditions.append(f'{EPOCH_SQL} >= ? AND ({EPOCH_SQL} > ? OR h.id > ?)')
+    where = 'WHERE ' + ' AND '.join(conditions)
+
+    query = f'''
+        SELECT {EPOCH_SQL}, h.id, h.sensor_id, s.sensor_type, h.value, h.timestamp
+        FROM historical_data h LEFT JOIN sensors s ON s.sensor_id = h.sensor_id
+        {where}
+        ORDER BY {EPOCH_SQL}, h.id
+        LIMIT ?
+    '''
+
+    last_epoch, last_id = -2 ** 63, -1
+    conn = connect(db_path, read_only=True)
+    try:
+        while True:
+            rows = conn.execute(query, params + [last_epoch, last_epoch, last_id, chunk_rows]).fetchall()
+            if not rows:
+                break
+            last_epoch, last_id = rows[-1][0], rows[-1][1]
+            yield [row[2:] for row in rows]
+            if len(rows) < chunk_rows:
+                break
+    finally:
+        conn.close()
+
+
+def _csv_chunks(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson_chunks(chunks):
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows).encode()
+
+
+def _arrow_chunks(chunks):
+    schema = pyarrow.schema([
+        ('sensor_id', pyarrow.string()),
+        ('sensor_type', pyarrow.string()),
+        ('value', pyarrow.float64()),
+        ('timestamp', pyarrow.string())
+    ])
+    sink = io.BytesIO()
+    writer = pyarrow.ipc.new_stream(sink, schema)
+    for rows in chunks:
+        columns = [pyarrow.array(column, type=field.type) for column, field in zip(zip(*rows), schema)]
+        writer.write_batch(pyarrow.record_batch(columns, schema=schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate(0)
+    writer.close()
+    yield sink.getvalue()
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(db_path, fmt='csv', sensor_ids=None, start=None, end=None, compress=False):
+    """Generator of encoded export bytes, optionally gzip-compressed
+
+    Arguments are validated up front so bad requests fail before any bytes
+    are streamed. Raises ValueError for an unknown format or timestamp.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if fmt == 'arrow' and pyarrow is None:
+        raise ValueError("Arrow export requires pyarrow to be installed")
+    start = _to_epoch(start) if start else None
+    end = _to_epoch(end) if end else None
+
+    chunks = iter_rows(db_path, sensor_ids, start, end)
+    encoders = {'csv': _csv_chunks, 'ndjson': _ndjson_chunks, 'arrow': _arrow_chunks}
+    stream = encoders[fmt](chunks)
+    return _gzip_chunks(stream) if compress else stream
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Project Vrishabhavathi - Database
+Connections and the versioned SQLite schema
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+
+DB_PATH = 'bengaluru_heart.db'
+
+# Bump when the schema below changes; stored in PRAGMA user_version.
+# Seed data is tracked separately (see seed_hash), so editing the sensor
+# list does not need a version bump.
+SCHEMA_VERSION = 2
+
+
+def connect(db_path=DB_PATH, read_only=False):
+    """Open a connection to a database file or a ``file:`` URI"""
+    if db_path.startswith('file:'):
+        return sqlite3.connect(db_path, uri=True)
+    if read_only:
+        return sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    return sqlite3.connect(db_path)
+
+
+def temp_db_dir():
+    """New temporary directory for a throwaway database, for tests
+
+    Placed on tmpfs (/dev/shm) when available, so it costs about as little
+    as an in-memory database while keeping normal file locking: concurrent
+    connections wait on the busy timeout instead of failing with
+    "database table is locked" as shared-cache memory databases do.
+    """
+    shm = '/dev/shm'
+    return tempfile.TemporaryDirectory(prefix='bengaluru_heart_', dir=shm if os.path.isdir(shm) else None)
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def seed_hash(sensors):
+    """Fingerprint of the static sensor definitions (ids, types, locations)"""
+    static = [
+        [sensor["id"], sensor["type"], sensor["location"], sensor["lat"], sensor["lng"]]
+        for sensor in sensors
+    ]
+    return hashlib.sha256(json.dumps(static, sort_keys=True).encode()).hexdigest()
+
+
+def get_seed_hash(conn):
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'sensor_seed'").fetchone()
+    except sqlite3.OperationalError:  # meta table not created yet
+        return None
+    return row[0] if row else None
+
+
+def _is_current(conn, seed):
+    return get_schema_version(conn) >= SCHEMA_VERSION and get_seed_hash(conn) == seed
+
+
+def ensure_schema(db_path, sensors):
+    """Create tables when the schema version changes, seed sensors when they do
+
+    A database that is already current costs a PRAGMA read and one meta
+    lookup. When several workers start together, BEGIN IMMEDIATE lets one of
+    them do the work while the rest wait and then find it already done.
+    """
+    seed = seed_hash(sensors)
+    conn = connect(db_path)
+    try:
+        if _is_current(conn, seed):
+            return False
+
+        conn.isolation_level = None
+        conn.execute('BEGIN IMMEDIATE')
+        if _is_current(conn, seed):
+            conn.execute('ROLLBACK')
+            return False
+
+        cursor = conn.cursor()
+
+        if get_schema_version(conn) < SCHEMA_VERSION:
+            _create_tables(cursor)
+            cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+        if get_seed_hash(conn) != seed:
+            _seed_sensors(cursor, sensors)
+            cursor.execute('''
+                INSERT OR REPLACE INTO meta (key, value) VALUES ('sensor_seed', ?)
+            ''', (seed,))
+
+        conn.execute('COMMIT')
+        return True
+    finally:
+        conn.close()
+
+
+def _create_tables(cursor):
+    # Create sensors table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sensors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sensor_id TEXT UNIQUE,
+            sensor_type TEXT,
+            location TEXT,
+            latitude REAL,
+            longitude REAL,
+            value REAL,
+            status TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Create ai_decisions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_decisions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            decision_type TEXT,
+            parameters TEXT,
+            action TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Create historical_data table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS historical_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sensor_id TEXT,
+            value REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Index historical_data by epoch time for range exports and replays
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_historical_epoch
+        ON historical_data (CAST(strftime('%s', timestamp) AS INTEGER))
+    ''')
+
+    # Bookkeeping such as the seeded sensor list's hash
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def _seed_sensors(cursor, sensors):
+    """Insert new sensors and refresh static fields of existing ones
+
+    Live value and status of sensors that already exist are left alone.
+    """
+    for sensor in sensors:
+        cursor.execute('''
+            INSERT INTO sensors
+            (sensor_id, sensor_type, location, latitude, longitude, value, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (sensor_id) DO UPDATE SET
+                sensor_type = excluded.sensor_type,
+                location = excluded.location,
+                latitude = excluded.latitude,
+                longitude = excluded.longitude
+        ''', (
+            sensor["id"], sensor["type"], sensor["location"],
+            sensor["lat"], sensor["lng"], sensor["value"], "active"
+        ))
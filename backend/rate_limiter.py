@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Project Vrishabhavathi - Ingest Rate Limiter
+Token-bucket admission control for sensor ingest
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEVICE_RATE = 2.0          # sustained requests/second per device
+DEVICE_BURST = 10          # requests a device may send back to back
+GLOBAL_RATE = 200.0        # sustained ingest requests/second for all devices
+GLOBAL_BURST = 400
+MAX_IN_FLIGHT = 16         # concurrent ingest requests touching the DB
+NEW_DEVICE_RATE = 0.2      # new device ids/second one client may introduce
+NEW_DEVICE_BURST = 20      # ...once the device table is under pressure
+MAX_TRACKED_DEVICES = 10000
+DEVICE_PRESSURE = 0.9      # fraction of MAX_TRACKED_DEVICES that counts as pressure
+
+
+class TokenBucket:
+    """Classic token bucket; refilled lazily on each check"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def try_acquire(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self):
+        """Seconds until the next token is available"""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class IngestRateLimiter:
+    """Per-device and global token buckets plus an in-flight cap
+
+    Every check is O(1). Device buckets are kept in LRU order and the
+    least recently seen device is dropped once MAX_TRACKED_DEVICES is
+    exceeded, so memory stays bounded however many ids show up.
+
+    New device ids are free while the device table has room, so a whole
+    fleet behind one gateway is admitted at once after a restart. Once it
+    is nearly full, an unseen id costs a token from the sending client's
+    new-device bucket, so a flooder rotating ids cannot evict known devices
+    faster than that.
+    """
+
+    def __init__(self, device_rate=DEVICE_RATE, device_burst=DEVICE_BURST,
+                 global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 max_in_flight=MAX_IN_FLIGHT, new_device_rate=NEW_DEVICE_RATE,
+                 new_device_burst=NEW_DEVICE_BURST, max_devices=MAX_TRACKED_DEVICES,
+                 device_pressure=DEVICE_PRESSURE):
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.new_device_rate = new_device_rate
+        self.new_device_burst = new_device_burst
+        self.max_devices = max_devices
+        self.pressure_devices = int(max_devices * device_pressure)
+        self.global_bucket = TokenBucket(global_rate, global_burst, time.monotonic())
+        self.devices = OrderedDict()
+        self.clients = OrderedDict()
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+
+        self.accepted = 0
+        self.throttled = {}  # device_id -> rejected request count
+        self.shed = 0        # rejected by the global limit or in-flight cap
+        self.rejected_new_devices = 0
+
+    def _lru_bucket(self, buckets, key, rate, burst, now):
+        """Get or create a bucket in an LRU OrderedDict bounded by max_devices"""
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst, now)
+            buckets[key] = bucket
+            if len(buckets) > self.max_devices:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def admit(self, device_id, client=None):
+        """Check limits for a device sending from ``client`` (its address)
+
+        Returns ``(True, None)`` if the request may proceed, in which case the
+        caller must call release() when done, or ``(False, (reason,
+        retry_after))`` if it should be rejected.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if device_id not in self.devices and len(self.devices) >= self.pressure_devices:
+                client_bucket = self._lru_bucket(
+                    self.clients, client, self.new_device_rate, self.new_device_burst, now
+                )
+                if not client_bucket.try_acquire(now):
+                    self.rejected_new_devices += 1
+                    return False, ('too many new devices from this client', client_bucket.retry_after())
+            bucket = self._lru_bucket(self.devices, device_id, self.device_rate, self.device_burst, now)
+
+            # A flooding device is rejected on its own bucket first, so it
+            # never spends global tokens that healthy devices need.
+            if not bucket.try_acquire(now):
+                if device_id in self.throttled or len(self.throttled) < self.max_devices:
+                    self.throttled[device_id] = self.throttled.get(device_id, 0) + 1
+                return False, ('device rate limit exceeded', bucket.retry_after())
+
+            if not self.global_bucket.try_acquire(now):
+                self.shed += 1
+                return False, ('ingest overloaded', self.global_bucket.retry_after())
+
+        if not self.in_flight.acquire(blocking=False):
+            with self.lock:
+                self.shed += 1
+            return False, ('ingest overloaded', 1.0)
+
+        with self.lock:
+            self.accepted += 1
+        return True, None
+
+    def release(self):
+        self.in_flight.release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'accepted': self.accepted,
+                'shed': self.shed,
+                'rejected_new_devices': self.rejected_new_devices,
+                'tracked_devices': len(self.devices),
+                'throttled_devices': dict(self.throttled)
+            }
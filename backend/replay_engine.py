@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Project Vrishabhavathi - Replay Engine
+Offline replay and backtesting of the AI brain against recorded sensor data
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+from collections import Counter
+from contextlib import closing
+from datetime import datetime, timezone
+
+from ai_brain import BengaluruAIBrain
+from database import DB_PATH, connect
+
+# Readings are bucketed into windows of this size; the brain is evaluated
+# once per window, just like one live make_decision() call.
+DEFAULT_WINDOW_MINUTES = 5
+DEFAULT_CHUNK_SIZE = 50000
+# Windows read per query. Each page is fetched in full before any result
+# is yielded, so no read lock is held while the consumer works and a replay
+# against the live database never blocks ingest writes.
+DEFAULT_PAGE_WINDOWS = 12
+# Time shards are a fixed span so serial and parallel runs split the data
+# identically and produce the same output.
+DEFAULT_SHARD_HOURS = 24
+
+# historical_data timestamps come either from CURRENT_TIMESTAMP
+# ("YYYY-MM-DD HH:MM:SS") or from the ESP32 payload (ISO 8601 with "T"),
+# so everything is compared as epoch seconds rather than as text.
+EPOCH_SQL = "CAST(strftime('%s', h.timestamp) AS INTEGER)"
+
+
+def _to_epoch(value):
+    """Convert a datetime or ISO string to epoch seconds (UTC)"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _from_epoch(seconds):
+    """Virtual clock: epoch seconds to a naive local datetime
+
+    Local, like the datetime.now() that live make_decision() uses for the
+    weather's hour and season and for the result timestamp.
+    """
+    return datetime.fromtimestamp(seconds)
+
+
+def _replay_shard(args):
+    """Worker entry point: replay one time shard and return its results"""
+    engine, first_bucket, last_bucket = args
+    return list(engine._replay_range(first_bucket, last_bucket))
+
+
+class ReplayEngine:
+    """Streams historical_data through BengaluruAIBrain on a virtual clock
+
+    Replays only read the database: the brain is asked to evaluate
+    conditions, never to store decisions. The one exception is the opt-in
+    ensure_indexes(), which adds indexes to speed up range queries.
+    """
+
+    def __init__(self, db_path=DB_PATH, window_minutes=DEFAULT_WINDOW_MINUTES,
+                 page_windows=DEFAULT_PAGE_WINDOWS, shard_hours=DEFAULT_SHARD_HOURS, workers=1,
+                 seed=0, brain_class=BengaluruAIBrain, brain_kwargs=None):
+        self.db_path = db_path
+        self.window_seconds = int(window_minutes * 60)
+        self.shard_windows = max(1, int(shard_hours * 3600) // self.window_seconds)
+        self.page_windows = page_windows
+        self.workers = workers
+        self.seed = seed
+        # Passed as class + kwargs so shards can rebuild the brain in a
+        # worker process, e.g. a subclass with different thresholds.
+        self.brain_class = brain_class
+        self.brain_kwargs = brain_kwargs or {}
+
+    def _connect(self):
+        return connect(self.db_path, read_only=True)
+
+    def ensure_indexes(self):
+        """Create the epoch indexes replay queries rely on, if possible
+
+        Without them every page is a full table scan. This writes to the
+        database, so it is opt-in; a missing or read-only database is left
+        untouched and replayed without them.
+        """
+        if not self.db_path.startswith('file:') and not os.path.exists(self.db_path):
+            return False
+        try:
+            with closing(connect(self.db_path)) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_historical_epoch
+                    ON historical_data (CAST(strftime('%s', timestamp) AS INTEGER))
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_historical_sensor_epoch
+                    ON historical_data (sensor_id, CAST(strftime('%s', timestamp) AS INTEGER))
+                ''')
+                conn.commit()
+            return True
+        except sqlite3.OperationalError as e:
+            print(f"Replay indexes unavailable: {e}")
+            return False
+
+    def _bucket_bounds(self, start=None, end=None):
+        """First and last window index that contain readings"""
+        with closing(self._connect()) as conn:
+            low, high = conn.execute(f'''
+                SELECT MIN({EPOCH_SQL}), MAX({EPOCH_SQL}) FROM historical_data h
+            ''').fetchone()
+
+        if low is None:
+            return None
+
+        start, end = _to_epoch(start), _to_epoch(end)
+        low = max(low, start) if start is not None else low
+        high = min(high, end - 1) if end is not None else high
+        if low > high:
+            return None
+        return low // self.window_seconds, high // self.window_seconds
+
+    def _initial_state(self, cursor, before):
+        """Latest value of every active sensor before the shard starts"""
+        cursor.execute(f'''
+            SELECT sensor_id, sensor_type, value FROM (
+                SELECT s.sensor_id, s.sensor_type, (
+                    SELECT h.value FROM historical_data h
+                    WHERE h.sensor_id = s.sensor_id AND {EPOCH_SQL} < ?
+                    ORDER BY {EPOCH_SQL} DESC LIMIT 1
+                ) AS value
+                FROM sensors s
+                WHERE s.status = 'active'
+            )
+            WHERE value IS NOT NULL
+            ORDER BY sensor_id
+        ''', (before,))
+        return cursor.fetchall()
+
+    def _read_page(self, cursor, first_bucket, last_bucket):
+        """Last reading per active sensor per window, grouped by window
+
+        One row per sensor per window, aggregated by SQLite instead of row
+        by row in Python. The statement is fully consumed before returning.
+        """
+        cursor.execute(f'''
+            SELECT bucket, sensor_id, sensor_type, value FROM (
+                SELECT {EPOCH_SQL} / ? AS bucket, h.sensor_id, s.sensor_type,
+                       h.value, MAX({EPOCH_SQL}) AS ts
+                FROM historical_data h JOIN sensors s ON s.sensor_id = h.sensor_id
+                WHERE s.status = 'active' AND {EPOCH_SQL} >= ? AND {EPOCH_SQL} < ?
+                GROUP BY bucket, h.sensor_id
+            )
+            ORDER BY bucket, sensor_id
+        ''', (self.window_seconds, first_bucket * self.window_seconds,
+              (last_bucket + 1) * self.window_seconds))
+
+        page = {}
+        for bucket, sensor_id, sensor_type, value in cursor.fetchall():
+            page.setdefault(bucket, []).append((sensor_id, sensor_type, value))
+        return page
+
+    def _replay_range(self, first_bucket, last_bucket):
+        """Replay windows first_bucket..last_bucket (inclusive) in order
+
+        Every window is evaluated, including ones where no sensor reported,
+        just as the live server decides on every call.
+        """
+        brain = self.brain_class(db_path=self.db_path, **self.brain_kwargs)
+
+        # Sensors keep their last reading until they report again, matching
+        # what the live sensors table would have held at that moment. Sums
+        # per type are maintained incrementally so a window costs O(updates)
+        # rather than O(sensors). As with the live AVG/COUNT(*) query, NULL
+        # readings count as sensors but not towards the average.
+        latest = {}
+        sums = {}
+        counts = {}
+        valued = {}
+
+        def apply(sensor_id, sensor_type, value):
+            if sensor_id in latest:
+                previous = latest[sensor_id][1]
+                if previous is not None:
+                    sums[sensor_type] -= previous
+                    valued[sensor_type] -= 1
+            else:
+                counts[sensor_type] = counts.get(sensor_type, 0) + 1
+            if value is not None:
+                sums[sensor_type] = sums.get(sensor_type, 0.0) + value
+                valued[sensor_type] = valued.get(sensor_type, 0) + 1
+            latest[sensor_id] = (sensor_type, value)
+
+        with closing(self._connect()) as conn:
+            initial = self._initial_state(conn.cursor(), first_bucket * self.window_seconds)
+        for sensor_id, sensor_type, value in initial:
+            apply(sensor_id, sensor_type, value)
+
+        for page_start in range(first_bucket, last_bucket + 1, self.page_windows):
+            page_end = min(page_start + self.page_windows - 1, last_bucket)
+            # A short-lived connection per page: nothing is open across yields
+            with closing(self._connect()) as conn:
+                page = self._read_page(conn.cursor(), page_start, page_end)
+
+            for bucket in range(page_start, page_end + 1):
+                for sensor_id, sensor_type, value in page.get(bucket, ()):
+                    apply(sensor_id, sensor_type, value)
+                yield self._evaluate(brain, bucket, sums, counts, valued)
+
+    def _evaluate(self, brain, bucket, sums, counts, valued):
+        """Evaluate the brain at the end of a window"""
+        now = _from_epoch((bucket + 1) * self.window_seconds)
+        sensor_data = {
+            sensor_type: {
+                'avg_value': sums[sensor_type] / valued[sensor_type] if valued.get(sensor_type) else None,
+                'count': count
+            }
+            for sensor_type, count in counts.items()
+        }
+        # Seeded per window so serial and sharded runs give identical output
+        rng = random.Random(self.seed * 1000003 + bucket)
+        weather_context = brain.get_weather_context(now=now, rng=rng)
+        return brain.evaluate(sensor_data, weather_context, timestamp=now)
+
+    def _shards(self, first_bucket, last_bucket):
+        """Split the window range into contiguous fixed-size shards"""
+        size = self.shard_windows
+        return [
+            (self, low, min(low + size - 1, last_bucket))
+            for low in range(first_bucket, last_bucket + 1, size)
+        ]
+
+    def replay(self, start=None, end=None):
+        """Yield one result per window, in time order
+
+        Each result has the same shape as BengaluruAIBrain.make_decision().
+        """
+        bounds = self._bucket_bounds(start, end)
+        if bounds is None:
+            return
+        shards = self._shards(*bounds)
+
+        if self.workers <= 1:
+            for _, first_bucket, last_bucket in shards:
+                yield from self._replay_range(first_bucket, last_bucket)
+            return
+
+        with multiprocessing.Pool(self.workers) as pool:
+            for results in pool.imap(_replay_shard, shards):
+                yield from results
+
+
+def load_archive(archive_path, db_path):
+    """Load an exported CSV or NDJSON archive into a replayable database
+
+    Each record needs sensor_id, sensor_type, value and timestamp. Archives
+    ending in ``.gz`` (``gzip=1`` exports) are decompressed on the fly, and
+    empty or null values are kept as NULL, as in the live database.
+    """
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sensors (
+            sensor_id TEXT PRIMARY KEY,
+            sensor_type TEXT,
+            status TEXT DEFAULT 'active'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS historical_data (
+            sensor_id TEXT,
+            value REAL,
+            timestamp DATETIME
+        )
+    ''')
+
+    if archive_path.endswith('.gz'):
+        f = gzip.open(archive_path, 'rt', newline='')
+        name = archive_path[:-len('.gz')]
+    else:
+        f = open(archive_path, newline='')
+        name = archive_path
+
+    with f:
+        if name.endswith(('.ndjson', '.jsonl')):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            records = csv.DictReader(f)
+
+        sensor_types = {}
+        batch = []
+        for record in records:
+            value = record['value']
+            sensor_types[record['sensor_id']] = record['sensor_type']
+            batch.append((record['sensor_id'], float(value) if value not in (None, '') else None, record['timestamp']))
+            if len(batch) >= DEFAULT_CHUNK_SIZE:
+                cursor.executemany('INSERT INTO historical_data VALUES (?, ?, ?)', batch)
+                batch = []
+        cursor.executemany('INSERT INTO historical_data VALUES (?, ?, ?)', batch)
+
+    cursor.executemany(
+        'INSERT OR REPLACE INTO sensors (sensor_id, sensor_type) VALUES (?, ?)',
+        sensor_types.items()
+    )
+    conn.commit()
+    conn.close()
+
+
+def summarize(results):
+    """Aggregate replay results into a backtest summary"""
+    decision_counts = Counter()
+    status_counts = Counter()
+    windows = 0
+    min_health = None
+
+    for result in results:
+        windows += 1
+        health = result['health_analysis']
+        status_counts[health['status']] += 1
+        if min_health is None or health['health_score'] < min_health['health_score']:
+            min_health = {'health_score': health['health_score'], 'timestamp': result['timestamp']}
+        for decision in result['decisions']:
+            decision_counts[decision['type']] += 1
+
+    return {
+        'windows': windows,
+        'decisions': dict(decision_counts),
+        'health_status': dict(status_counts),
+        'min_health': min_health
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded sensor data through the AI brain')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database to replay')
+    parser.add_argument('--archive', help='CSV or NDJSON export (optionally .gz) to replay instead of the database')
+    parser.add_argument('--start', help='ISO timestamp to start from (UTC)')
+    parser.add_argument('--end', help='ISO timestamp to stop before (UTC)')
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW_MINUTES, help='Window size in minutes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for simulated weather')
+    parser.add_argument('--output', help='Write every window result as NDJSON to this file')
+    parser.add_argument('--create-indexes', action='store_true',
+                        help='Add epoch indexes to --db first (writes to the database)')
+    args = parser.parse_args()
+
+    db_path = args.db
+    tmp_dir = None
+    if args.archive:
+        tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmp_dir.name, 'replay.db')
+        load_archive(args.archive, db_path)
+
+    engine = ReplayEngine(db_path, window_minutes=args.window, workers=args.workers, seed=args.seed)
+    if args.archive or args.create_indexes:
+        engine.ensure_indexes()
+    results = engine.replay(args.start, args.end)
+
+    if args.output:
+        def tee(results, f):
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+                yield result
+        with open(args.output, 'w') as f:
+            summary = summarize(tee(results, f))
+    else:
+        summary = summarize(results)
+
+    print("🧠 Replay Summary:")
+    print(json.dumps(summary, indent=2))
+
+    if tmp_dir:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Project Vrishabhavathi - Weather Context
+Pluggable weather providers behind a non-blocking TTL cache
+"""
+
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+# Month -> season lookup, so the season is a dict read instead of a branch chain
+SEASONS_BY_MONTH = {
+    6: 'monsoon', 7: 'monsoon', 8: 'monsoon', 9: 'monsoon',
+    10: 'winter', 11: 'winter', 12: 'winter', 1: 'winter',
+    2: 'summer', 3: 'summer', 4: 'summer', 5: 'summer'
+}
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_REFRESH_SECONDS = 60
+# stop() gives up waiting after this; the refresher is a daemon thread, so a
+# provider stuck in fetch() cannot hold up shutdown
+DEFAULT_STOP_TIMEOUT_SECONDS = 5
+
+# Used only until the first successful fetch
+FALLBACK_CONTEXT = {
+    'rain_probability': 0.1,
+    'season': 'summer',
+    'temperature': 27.5,
+    'humidity': 65.0
+}
+
+
+def get_season(now=None):
+    """Determine the season for a given time"""
+    return SEASONS_BY_MONTH[(now or datetime.now()).month]
+
+
+def simulate_weather(now=None, rng=None):
+    """Simulated weather context for a given time"""
+    now = now or datetime.now()
+    rng = rng or random
+    season = get_season(now)
+
+    # Simulate weather patterns
+    if 6 <= now.hour <= 18:  # Daytime
+        rain_probability = 0.3 if season == 'monsoon' else 0.1
+    else:  # Nighttime
+        rain_probability = 0.2 if season == 'monsoon' else 0.05
+
+    return {
+        'rain_probability': rain_probability,
+        'season': season,
+        'temperature': rng.uniform(20, 35),
+        'humidity': rng.uniform(40, 90)
+    }
+
+
+class WeatherProvider(ABC):
+    """Source of weather context; fetch() may block on I/O"""
+
+    @abstractmethod
+    def fetch(self):
+        """Return a weather context dict like simulate_weather()'s"""
+
+
+class SimulatedWeatherProvider(WeatherProvider):
+    """Simulated weather based on time of day and season"""
+
+    def fetch(self):
+        return simulate_weather()
+
+
+class FileWeatherProvider(WeatherProvider):
+    """Reads weather context from a local JSON file, for tests and offline use"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self):
+        with open(self.path) as f:
+            context = json.load(f)
+        context.setdefault('season', get_season())
+        return context
+
+
+class WeatherContextCache:
+    """TTL cache over a WeatherProvider with stale-while-revalidate
+
+    get() never blocks: it returns the last fetched context, and if that is
+    older than the TTL it wakes the background refresher and still returns
+    the stale value. The refresher also polls on a fixed interval.
+    """
+
+    def __init__(self, provider, ttl=DEFAULT_TTL_SECONDS, refresh_interval=DEFAULT_REFRESH_SECONDS):
+        self.provider = provider
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._context = dict(FALLBACK_CONTEXT, season=get_season())
+        self._fetched_at = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the background refresher (idempotent)"""
+        with self._lock:
+            if self._thread is None and not self._stopped.is_set():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=DEFAULT_STOP_TIMEOUT_SECONDS):
+        """Stop the background refresher; get() keeps serving the last context"""
+        self._stopped.set()
+        self._wake.set()
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def refresh(self):
+        """Fetch from the provider now; keeps the old context on failure"""
+        try:
+            context = self.provider.fetch()
+        except Exception as e:
+            print(f"Weather provider error: {e}")
+            return False
+        # Single reference swap, so readers never see a partial update
+        self._context = context
+        self._fetched_at = time.monotonic()
+        return True
+
+    def is_stale(self):
+        return self._fetched_at is None or time.monotonic() - self._fetched_at > self.ttl
+
+    def get(self):
+        """Return a copy of the cached context without waiting on the provider
+
+        A copy, so callers that modify a decision's weather_context cannot
+        corrupt the cache for later decisions.
+        """
+        if self._thread is None:
+            self.start()
+        elif self.is_stale() and not self._stopped.is_set():
+            self._wake.set()
+        return dict(self._context)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.refresh()
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()